@@ -1,14 +1,25 @@
 import os
+import hmac
 import json
+import signal
+import time
 import numpy as np
 import tensorflow as tf
-from flask import Flask, request, jsonify
+import hashlib
+import threading
+from collections import OrderedDict
+from flask import Flask, request, jsonify, Response, stream_with_context
+from werkzeug.serving import make_server
+from werkzeug.http import parse_options_header
 from flask_cors import CORS
 from PIL import Image
 from io import BytesIO
 import logging
 import base64
 from translations import translate_class_name
+import video
+import memguard
+import profiling
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -18,10 +29,27 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
+# Count requests until their response has been fully sent, so a draining
+# worker never exits in the middle of writing one
+app.wsgi_app = memguard.TrackRequests(app.wsgi_app, untracked_paths={'/health', '/admin/memory'})
+
 # Global variables to hold the model and class indices
 model = None
 class_indices = None
 
+# Recent predictions keyed by the SHA-256 of the image bytes
+CACHE_SIZE = int(os.environ.get("PREDICTION_CACHE_SIZE", 256))
+prediction_cache = OrderedDict()
+cache_lock = threading.Lock()
+
+# Admin features need this token in the X-Admin-Token header and are off
+# when it is not set. The caller's address is not trusted, requests arrive
+# from localhost when they come through router.py
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+
+# Seconds a stopping worker waits for in-flight requests to finish
+DRAIN_TIMEOUT = float(os.environ.get("WORKER_DRAIN_TIMEOUT", 60))
+
 def load_model():
     """Load the TensorFlow model."""
     global model
@@ -84,6 +112,77 @@ def determine_severity(confidence):
     else:
         return "low"
 
+def ensure_model_loaded():
+    """Load the model and class indices if they are not loaded yet."""
+    if model is None or class_indices is None:
+        success_model = load_model()
+        success_indices = load_class_indices()
+        return success_model and success_indices
+    return True
+
+def run_inference(batch):
+    """Run the model on a preprocessed batch and return the raw scores."""
+    with profiling.tf_trace():
+        # Handle different model formats
+        if hasattr(model, 'predict'):
+            # For Keras models
+            return model.predict(batch)
+        
+        # For SavedModel format
+        infer = model.signatures["serving_default"]
+        predictions = infer(tf.constant(batch))
+        return list(predictions.values())[0].numpy()
+
+def describe_prediction(scores):
+    """Turn one row of model scores into the prediction payload."""
+    # Get the predicted class index
+    predicted_index = int(np.argmax(scores))
+    confidence = float(np.max(scores))
+    
+    # Get the class name
+    class_name = class_indices.get(str(predicted_index), "Unknown")
+    
+    # Translate class name
+    english_name, arabic_name = translate_class_name(class_name)
+    
+    return {
+        "class_en": english_name,
+        "class_ar": arabic_name,
+        "confidence": round(confidence, 2),
+        "severity": determine_severity(confidence)
+    }
+
+def get_cached_prediction(image_hash):
+    """Return the cached prediction for an image hash, if any."""
+    with cache_lock:
+        prediction = prediction_cache.get(image_hash)
+        if prediction is not None:
+            prediction_cache.move_to_end(image_hash)
+        return prediction
+
+def cache_prediction(image_hash, prediction):
+    """Store a prediction, evicting the least recently used entries."""
+    if CACHE_SIZE <= 0:
+        return
+    with cache_lock:
+        prediction_cache[image_hash] = prediction
+        prediction_cache.move_to_end(image_hash)
+        while len(prediction_cache) > CACHE_SIZE:
+            prediction_cache.popitem(last=False)
+
+def predict_images(images):
+    """Predict a list of PIL images in a single model call."""
+    batch = np.concatenate([preprocess_image(img) for img in images], axis=0)
+    predictions = run_inference(batch)
+    return [describe_prediction(scores) for scores in predictions]
+
+def is_admin_request():
+    """Check whether the current request may use admin features."""
+    if not ADMIN_TOKEN:
+        return False
+    token = request.headers.get('X-Admin-Token', '')
+    return hmac.compare_digest(token, ADMIN_TOKEN)
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint."""
@@ -96,35 +195,41 @@ def health_check():
     return jsonify({"status": "ok", "message": "Model and class indices loaded successfully"}), 200
 
 @app.route('/predict', methods=['POST'])
+@profiling.profiled(is_admin_request)
 def predict():
     """Endpoint to make predictions on uploaded images."""
     try:
         # Check if the model and class indices are loaded
-        if model is None or class_indices is None:
-            success_model = load_model()
-            success_indices = load_class_indices()
-            
-            if not success_model or not success_indices:
-                return jsonify({
-                    "status": "error",
-                    "message": "Failed to load model or class indices"
-                }), 500
+        if not ensure_model_loaded():
+            return jsonify({
+                "status": "error",
+                "message": "Failed to load model or class indices"
+            }), 500
         
-        # Get image from request
+        # Get image bytes from request
         if 'file' in request.files:
-            file = request.files['file']
-            img = Image.open(file.stream).convert('RGB')
+            img_data = request.files['file'].read()
         elif 'image' in request.form:
             # Handle base64 encoded image
             encoded_img = request.form['image']
             img_data = base64.b64decode(encoded_img)
-            img = Image.open(BytesIO(img_data)).convert('RGB')
         else:
             return jsonify({
                 "status": "error",
                 "message": "No image file or base64 image provided"
             }), 400
         
+        # Serve repeated images from the cache
+        image_hash = hashlib.sha256(img_data).hexdigest()
+        prediction = get_cached_prediction(image_hash)
+        if prediction is not None:
+            logger.info(f"Cache hit for image {image_hash[:12]}")
+            response = jsonify({"status": "success", "prediction": prediction})
+            response.headers['X-Cache'] = 'HIT'
+            return response, 200
+        
+        img = Image.open(BytesIO(img_data)).convert('RGB')
+        
         # Preprocess the image
         processed_img = preprocess_image(img)
         if processed_img is None:
@@ -135,43 +240,20 @@ def predict():
         
         # Make prediction
         logger.info("Making prediction...")
-        
-        # Handle different model formats
-        if hasattr(model, 'predict'):
-            # For Keras models
-            predictions = model.predict(processed_img)
-        else:
-            # For SavedModel format
-            infer = model.signatures["serving_default"]
-            predictions = infer(tf.constant(processed_img))
-            predictions = list(predictions.values())[0].numpy()
-        
-        # Get the predicted class index
-        predicted_index = np.argmax(predictions, axis=1)[0]
-        confidence = float(np.max(predictions))
-        
-        # Get the class name
-        class_name = class_indices.get(str(predicted_index), "Unknown")
-        
-        # Translate class name
-        english_name, arabic_name = translate_class_name(class_name)
-        
-        # Determine severity
-        severity = determine_severity(confidence)
+        predictions = run_inference(processed_img)
+        prediction = describe_prediction(predictions[0])
+        cache_prediction(image_hash, prediction)
         
         # Return prediction result
         result = {
             "status": "success",
-            "prediction": {
-                "class_en": english_name,
-                "class_ar": arabic_name,
-                "confidence": round(confidence, 2),
-                "severity": severity
-            }
+            "prediction": prediction
         }
         
         logger.info(f"Prediction: {result}")
-        return jsonify(result), 200
+        response = jsonify(result)
+        response.headers['X-Cache'] = 'MISS'
+        return response, 200
         
     except Exception as e:
         logger.error(f"Error making prediction: {str(e)}")
@@ -180,12 +262,116 @@ def predict():
             "message": f"Error processing image: {str(e)}"
         }), 500
 
+@app.route('/predict/video', methods=['POST'])
+def predict_video():
+    """
+    Endpoint to analyze a video or an ordered frame sequence.
+
+    Accepts either a 'video' file or several 'frames' files and streams back
+    newline-delimited JSON events: one per analyzed frame, one per finished
+    segment and a final summary.
+    """
+    if not ensure_model_loaded():
+        return jsonify({
+            "status": "error",
+            "message": "Failed to load model or class indices"
+        }), 500
+    
+    try:
+        sample_fps = float(request.args.get('sample_fps', video.DEFAULT_SAMPLE_FPS))
+        source_fps = request.args.get('source_fps', type=float)
+        batch_size = int(request.args.get('batch_size', video.DEFAULT_BATCH_SIZE))
+        segment_seconds = float(request.args.get('segment_seconds', video.DEFAULT_SEGMENT_SECONDS))
+        dedup_threshold = int(request.args.get('dedup_threshold', video.DEFAULT_DEDUP_THRESHOLD))
+        if sample_fps <= 0 or batch_size <= 0 or segment_seconds <= 0:
+            raise ValueError("sample_fps, batch_size and segment_seconds must be positive")
+    except ValueError as e:
+        return jsonify({
+            "status": "error",
+            "message": f"Invalid parameters: {str(e)}"
+        }), 400
+    
+    # The body is decoded while it arrives instead of through request.files,
+    # which would buffer every part before the first result could be sent
+    mimetype, options = parse_options_header(request.headers.get('Content-Type', ''))
+    boundary = options.get('boundary')
+    if mimetype != 'multipart/form-data' or not boundary:
+        return jsonify({
+            "status": "error",
+            "message": "Expected a multipart/form-data upload with a video file or frames"
+        }), 400
+    
+    def generate():
+        try:
+            frames = video.iter_multipart_frames(request.stream, boundary.encode('latin-1'),
+                                                 sample_fps, source_fps)
+            events = video.analyze_frames(frames, predict_images,
+                                          batch_size=batch_size,
+                                          segment_seconds=segment_seconds,
+                                          dedup_threshold=dedup_threshold)
+            for event in events:
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+        except Exception as e:
+            logger.error(f"Error analyzing video: {str(e)}")
+            yield json.dumps({"type": "error", "message": f"Error processing video: {str(e)}"}) + "\n"
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/admin/memory', methods=['GET'])
+def admin_memory():
+    """Admin endpoint with this worker's memory and request statistics."""
+    if not is_admin_request():
+        return jsonify({"status": "error", "message": "Forbidden"}), 403
+    
+    top = request.args.get('top', 10, type=int)
+    return jsonify({"status": "ok", "worker": memguard.stats(top)}), 200
+
+def serve(port):
+    """Serve the app until SIGTERM, then finish in-flight requests and exit."""
+    # Under the run.py supervisor the listening socket is inherited, so a
+    # replacement worker can accept connections while this one drains
+    fd = os.environ.get("WORKER_FD")
+    server = make_server('0.0.0.0', port, app, threaded=True,
+                         fd=int(fd) if fd else None)
+    # Handler threads must not be daemons, or a connection that was accepted
+    # but is still reading its request would be cut off when the worker exits
+    server.daemon_threads = False
+    
+    def handle_sigterm(sig, frame):
+        logger.info("Received shutdown signal, finishing in-flight requests...")
+        # shutdown() blocks until serve_forever() returns, so call it elsewhere
+        threading.Thread(target=server.shutdown, daemon=True).start()
+    
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    
+    # Tell the supervisor this worker is ready to take requests
+    ready_fd = os.environ.get("WORKER_READY_FD")
+    if ready_fd:
+        os.write(int(ready_fd), b"1")
+        os.close(int(ready_fd))
+    
+    logger.info(f"Worker {os.getpid()} serving on port {port}")
+    server.serve_forever()
+    
+    deadline = time.monotonic() + DRAIN_TIMEOUT
+    drained = (memguard.wait_for_idle(DRAIN_TIMEOUT)
+               and memguard.wait_for_threads(max(0, deadline - time.monotonic())))
+    if not drained:
+        # Idle keep-alive connections would otherwise keep the worker alive
+        logger.warning("Timed out waiting for in-flight requests")
+        logging.shutdown()
+        os._exit(1)
+    server.server_close()
+    logger.info(f"Worker {os.getpid()} stopped")
+
 # Load the model and class indices when the app starts
 if __name__ == '__main__':
+    memguard.start()
+    
     # Try to load model and class indices
     load_model()
     load_class_indices()
     
     # Run the app
     port = int(os.environ.get("PORT", 5001))
-    app.run(host='0.0.0.0', port=port)
\ No newline at end of file
+    serve(port)
\ No newline at end of file
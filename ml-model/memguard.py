@@ -0,0 +1,190 @@
+"""
+Memory tracking and recycle triggers for ml-model workers.
+
+Each worker counts the requests it serves and watches its resident memory.
+Once it passes WORKER_MAX_REQUESTS or WORKER_MAX_RSS_MB (after running for at
+least WORKER_MIN_UPTIME) it asks the run.py supervisor, with SIGUSR1, to
+start a warm replacement and drain this worker.
+"""
+import os
+import time
+import signal
+import logging
+import resource
+import threading
+import tracemalloc
+from werkzeug.wsgi import ClosingIterator
+
+logger = logging.getLogger(__name__)
+
+# Recycle limits, 0 disables a limit
+MAX_REQUESTS = int(os.environ.get("WORKER_MAX_REQUESTS", 0))
+MAX_RSS_MB = float(os.environ.get("WORKER_MAX_RSS_MB", 0))
+# Seconds a worker must run before its RSS can trigger a recycle, so a limit
+# below the size of a freshly loaded worker cannot cause a recycle loop
+MIN_UPTIME = float(os.environ.get("WORKER_MIN_UPTIME", 300))
+# Number of stack frames tracemalloc records per allocation, 0 disables it
+TRACEMALLOC_FRAMES = int(os.environ.get("WORKER_TRACEMALLOC", 0))
+
+# Worker state
+started_at = time.time()
+requests_served = 0
+in_flight = 0
+recycle_reason = None
+state_lock = threading.Lock()
+idle = threading.Condition(state_lock)
+
+def read_rss(pid="self"):
+    """Return the resident memory of a process in bytes, or None if unknown."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+
+    if pid == "self":
+        # Without /proc only the peak is available
+        return read_peak_rss()
+    return None
+
+def read_peak_rss():
+    """Return the peak resident memory of this process in bytes."""
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def supervisor_pid():
+    """Return the PID of the run.py supervisor, or None if not supervised."""
+    pid = os.environ.get("WORKER_SUPERVISOR_PID")
+    return int(pid) if pid else None
+
+def start():
+    """Start allocation tracking if it is enabled."""
+    if TRACEMALLOC_FRAMES > 0 and not tracemalloc.is_tracing():
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+        logger.info(f"tracemalloc enabled with {TRACEMALLOC_FRAMES} frames")
+
+def request_started():
+    """Record that a request has started."""
+    global in_flight
+    with state_lock:
+        in_flight += 1
+
+def request_finished():
+    """Record that a request has finished and check the recycle limits."""
+    global in_flight, requests_served
+    with state_lock:
+        in_flight -= 1
+        requests_served += 1
+        served = requests_served
+        if in_flight == 0:
+            idle.notify_all()
+
+    if MAX_REQUESTS and served >= MAX_REQUESTS:
+        request_recycle(f"served {served} requests")
+        return
+
+    if MAX_RSS_MB and time.time() - started_at >= MIN_UPTIME:
+        rss = read_rss()
+        if rss is not None and rss > MAX_RSS_MB * 1024 * 1024:
+            request_recycle(f"RSS {rss / 1024 / 1024:.0f} MB over {MAX_RSS_MB:.0f} MB")
+
+def request_recycle(reason):
+    """Ask the supervisor to replace this worker, only once."""
+    global recycle_reason
+    with state_lock:
+        if recycle_reason is not None:
+            return
+        recycle_reason = reason
+
+    logger.warning(f"Worker {os.getpid()} needs recycling: {reason}")
+    supervisor = supervisor_pid()
+    if supervisor is None:
+        return
+    if os.getppid() != supervisor:
+        # Never signal whatever process adopted us after the supervisor died
+        logger.error(f"Supervisor {supervisor} is gone, cannot request recycling")
+        return
+    try:
+        os.kill(supervisor, signal.SIGUSR1)
+    except OSError as e:
+        logger.error(f"Could not signal supervisor {supervisor}: {str(e)}")
+
+class TrackRequests:
+    """
+    WSGI middleware that counts requests as in flight until the server has
+    finished sending the response and closes it.
+    """
+
+    def __init__(self, app, untracked_paths=()):
+        self.app = app
+        self.untracked_paths = set(untracked_paths)
+
+    def __call__(self, environ, start_response):
+        if environ.get('PATH_INFO') in self.untracked_paths:
+            return self.app(environ, start_response)
+
+        request_started()
+        try:
+            response = self.app(environ, start_response)
+        except BaseException:
+            request_finished()
+            raise
+        return ClosingIterator(response, request_finished)
+
+def wait_for_idle(timeout):
+    """Wait until no request is in flight, returns False on timeout."""
+    with state_lock:
+        return idle.wait_for(lambda: in_flight == 0, timeout=timeout)
+
+def wait_for_threads(timeout):
+    """
+    Wait for the other non-daemon threads, such as request handlers that are
+    still reading a request, returns False on timeout.
+    """
+    deadline = time.monotonic() + timeout
+    for thread in threading.enumerate():
+        if thread is threading.current_thread() or thread.daemon:
+            continue
+        thread.join(max(0, deadline - time.monotonic()))
+        if thread.is_alive():
+            return False
+    return True
+
+def top_allocations(limit=10):
+    """Return the allocation sites holding the most memory."""
+    if not tracemalloc.is_tracing():
+        return None
+
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+    sites = []
+    for stat in snapshot.statistics("traceback")[:limit]:
+        sites.append({
+            "size_kb": round(stat.size / 1024, 1),
+            "count": stat.count,
+            "traceback": stat.traceback.format()
+        })
+    return sites
+
+def stats(top=10):
+    """Return the memory and request statistics of this worker."""
+    rss = read_rss()
+    with state_lock:
+        result = {
+            "pid": os.getpid(),
+            "supervisor_pid": supervisor_pid(),
+            "uptime_seconds": round(time.time() - started_at, 1),
+            "rss_mb": round(rss / 1024 / 1024, 1) if rss is not None else None,
+            "peak_rss_mb": round(read_peak_rss() / 1024 / 1024, 1),
+            "requests_served": requests_served,
+            "in_flight": in_flight,
+            "max_requests": MAX_REQUESTS or None,
+            "max_rss_mb": MAX_RSS_MB or None,
+            "recycle_reason": recycle_reason
+        }
+    result["top_allocations"] = top_allocations(top)
+    return result
@@ -0,0 +1,175 @@
+"""
+On-demand profiling of prediction requests.
+
+An admin can profile a single request by sending the X-Profile header (or the
+profile query parameter) with "inline" to get the cProfile stats back in the
+JSON response, or "save" to write a .prof file to PROFILE_DIR. Adding
+X-Profile-TF: 1 (or profile_tf=1) also records a TensorFlow profiler trace of
+the model call. With PROFILE_SAMPLE_RATE=N every Nth request is profiled and
+saved as well.
+"""
+import os
+import io
+import time
+import json
+import uuid
+import shutil
+import pstats
+import cProfile
+import logging
+import functools
+import itertools
+import threading
+from contextlib import contextmanager
+from flask import request, g, has_request_context, make_response
+
+logger = logging.getLogger(__name__)
+
+# Profiling settings
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+# Profile one in every N requests, 0 disables sampling
+SAMPLE_RATE = int(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+# Also record a TensorFlow trace for sampled requests
+SAMPLE_TF = os.environ.get("PROFILE_SAMPLE_TF", "0") == "1"
+# Saved profiles and TF traces kept each, the oldest are removed
+MAX_FILES = int(os.environ.get("PROFILE_MAX_FILES", 100))
+# Number of functions listed in inline stats
+INLINE_TOP = 30
+
+PROFILE_MODES = {'inline', 'save'}
+
+# Only one profiled request at a time, the TensorFlow profiler is global
+profile_lock = threading.Lock()
+request_counter = itertools.count(1)
+
+def requested_profile(authorize):
+    """
+    Work out how the current request should be profiled.
+
+    Returns a (mode, tf_trace, authorized) tuple, with mode None when the
+    request is not profiled. authorized is False for sampled requests, which
+    must not see any profiling details in their response.
+    """
+    mode = request.headers.get('X-Profile') or request.args.get('profile')
+    if mode:
+        mode = 'save' if mode == '1' else mode.lower()
+        if mode in PROFILE_MODES and authorize():
+            tf_trace = (request.headers.get('X-Profile-TF') or request.args.get('profile_tf')) == '1'
+            return mode, tf_trace, True
+
+    if SAMPLE_RATE and next(request_counter) % SAMPLE_RATE == 0:
+        return 'save', SAMPLE_TF, False
+
+    return None, False, False
+
+def profile_name(endpoint):
+    """Build a unique file name for a request profile."""
+    return f"{endpoint}-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:12]}"
+
+def prune_profiles(directory):
+    """Remove the oldest profiles in a directory beyond PROFILE_MAX_FILES."""
+    try:
+        entries = [entry for entry in os.scandir(directory) if entry.name != 'tf']
+    except FileNotFoundError:
+        return
+
+    def modified(entry):
+        try:
+            return entry.stat().st_mtime
+        except OSError:  # Removed by a concurrent prune
+            return 0
+
+    entries.sort(key=modified, reverse=True)
+    for entry in entries[MAX_FILES:]:
+        try:
+            if entry.is_dir():
+                shutil.rmtree(entry.path)
+            else:
+                os.remove(entry.path)
+        except OSError as e:
+            logger.warning(f"Could not remove old profile {entry.path}: {str(e)}")
+
+def format_stats(profiler):
+    """Format the most expensive calls of a profile as text."""
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream)
+    stats.sort_stats('cumulative').print_stats(INLINE_TOP)
+    return stream.getvalue()
+
+@contextmanager
+def tf_trace():
+    """Record a TensorFlow profiler trace if the current request asked for one."""
+    logdir = g.get('profile_tf_logdir') if has_request_context() else None
+    if not logdir:
+        yield
+        return
+
+    import tensorflow as tf
+    tf.profiler.experimental.start(logdir)
+    try:
+        yield
+    finally:
+        tf.profiler.experimental.stop()
+
+def profiled(authorize):
+    """Decorator that profiles a view when requested or sampled."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            mode, trace_tf, authorized = requested_profile(authorize)
+            if mode is None:
+                return view(*args, **kwargs)
+
+            if not profile_lock.acquire(blocking=False):
+                # Another request is being profiled, serve this one normally
+                if not authorized:
+                    return view(*args, **kwargs)
+                response = make_response(view(*args, **kwargs))
+                response.headers['X-Profile'] = 'busy'
+                return response
+
+            try:
+                name = profile_name(request.endpoint)
+                if trace_tf:
+                    g.profile_tf_logdir = os.path.join(PROFILE_DIR, 'tf', name)
+
+                profiler = cProfile.Profile()
+                started = time.perf_counter()
+                profiler.enable()
+                try:
+                    response = make_response(view(*args, **kwargs))
+                finally:
+                    profiler.disable()
+                elapsed = time.perf_counter() - started
+            finally:
+                profile_lock.release()
+
+            tf_logdir = g.pop('profile_tf_logdir', None)
+            if tf_logdir:
+                prune_profiles(os.path.join(PROFILE_DIR, 'tf'))
+                logger.info(f"Saved TensorFlow trace to {tf_logdir}")
+            if authorized:
+                response.headers['X-Profile-Time'] = f"{elapsed * 1000:.1f}ms"
+                if tf_logdir:
+                    response.headers['X-Profile-TF-Dir'] = tf_logdir
+
+            if mode == 'inline' and response.is_json:
+                data = response.get_json()
+                data["profile"] = {
+                    "elapsed_ms": round(elapsed * 1000, 1),
+                    "stats": format_stats(profiler),
+                    "tf_trace_dir": tf_logdir
+                }
+                response.set_data(json.dumps(data))
+            else:
+                os.makedirs(PROFILE_DIR, exist_ok=True)
+                path = os.path.join(PROFILE_DIR, f"{name}.prof")
+                profiler.dump_stats(path)
+                if authorized:
+                    response.headers['X-Profile-File'] = path
+                prune_profiles(PROFILE_DIR)
+                logger.info(f"Saved request profile to {path} ({elapsed * 1000:.1f}ms)")
+
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,323 @@
+"""
+Router that spreads prediction requests over several ml-model instances.
+
+Requests for the same image are sent to the same instance (consistent hashing
+on the image bytes) so repeated images hit that instance's prediction cache,
+unless that instance is much busier than the least loaded one.
+
+Example with two instances:
+
+    FLASK_PORT=5002 python run.py
+    FLASK_PORT=5003 python run.py
+    ML_BACKENDS=http://localhost:5002,http://localhost:5003 ROUTER_PORT=5001 python router.py
+"""
+import os
+import time
+import base64
+import bisect
+import hashlib
+import logging
+import threading
+import requests
+from flask import Flask, request, jsonify, Response
+from flask_cors import CORS
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Router settings
+BACKENDS = [url.strip().rstrip('/') for url in os.environ.get("ML_BACKENDS", "").split(',') if url.strip()]
+HEALTH_INTERVAL = float(os.environ.get("ROUTER_HEALTH_INTERVAL", 5))
+HEALTH_TIMEOUT = float(os.environ.get("ROUTER_HEALTH_TIMEOUT", 2))
+REQUEST_TIMEOUT = float(os.environ.get("ROUTER_REQUEST_TIMEOUT", 30))
+# How many more in-flight requests the cache-affine instance may have than
+# the least loaded one before the request is sent elsewhere
+AFFINITY_SLACK = int(os.environ.get("ROUTER_AFFINITY_SLACK", 2))
+VIRTUAL_NODES = 100
+
+# Hop-by-hop headers that must not be copied between connections
+HOP_HEADERS = {'connection', 'keep-alive', 'transfer-encoding', 'content-length',
+               'content-encoding', 'te', 'trailer', 'upgrade'}
+# Response headers the router sets itself
+ROUTER_HEADERS = {'server', 'date'}
+
+# Initialize Flask app
+app = Flask(__name__)
+CORS(app)  # Enable CORS for all routes
+
+class Backend:
+    """One ml-model instance and its routing state."""
+
+    def __init__(self, url):
+        self.url = url
+        self.healthy = False
+        self.in_flight = 0
+        self.served = 0
+        self.last_error = None
+
+    def to_dict(self):
+        """Status of this backend for the health endpoint."""
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "in_flight": self.in_flight,
+            "served": self.served,
+            "last_error": self.last_error
+        }
+
+class HashRing:
+    """Consistent hash ring with virtual nodes."""
+
+    def __init__(self, backends, virtual_nodes=VIRTUAL_NODES):
+        self.positions = []
+        self.owners = []
+        points = []
+        for backend in backends:
+            for replica in range(virtual_nodes):
+                points.append((self._hash(f"{backend.url}#{replica}"), backend))
+        points.sort(key=lambda point: point[0])
+        for position, backend in points:
+            self.positions.append(position)
+            self.owners.append(backend)
+
+    @staticmethod
+    def _hash(key):
+        """Map a key to a position on the ring."""
+        return int(hashlib.md5(key.encode('utf-8')).hexdigest()[:16], 16)
+
+    def lookup(self, key, accept):
+        """Return the first accepted backend clockwise from the key."""
+        if not self.positions:
+            return None
+        start = bisect.bisect(self.positions, self._hash(key))
+        for offset in range(len(self.positions)):
+            backend = self.owners[(start + offset) % len(self.owners)]
+            if accept(backend):
+                return backend
+        return None
+
+# The ring always holds every configured backend; unhealthy ones are skipped
+# on lookup, so their keys move to the next instance and come back on rejoin
+backends = [Backend(url) for url in BACKENDS]
+ring = HashRing(backends)
+state_lock = threading.Lock()
+
+def check_backend(backend):
+    """Probe a backend's health endpoint and update its state."""
+    try:
+        response = requests.get(f"{backend.url}/health", timeout=HEALTH_TIMEOUT)
+        healthy = response.status_code == 200
+        error = None if healthy else response.json().get("message", f"HTTP {response.status_code}")
+    except (requests.RequestException, ValueError) as e:
+        healthy = False
+        error = str(e)
+
+    with state_lock:
+        if healthy != backend.healthy:
+            logger.info(f"Backend {backend.url} is now {'healthy' if healthy else 'unhealthy'}")
+        backend.healthy = healthy
+        backend.last_error = error
+
+def health_loop():
+    """Periodically re-check every backend."""
+    while True:
+        time.sleep(HEALTH_INTERVAL)
+        for backend in backends:
+            check_backend(backend)
+
+def mark_unhealthy(backend, error):
+    """Take a backend out of rotation until the next successful health check."""
+    with state_lock:
+        if backend.healthy:
+            logger.warning(f"Backend {backend.url} failed: {error}")
+        backend.healthy = False
+        backend.last_error = error
+
+def choose_backend(image_hash=None, exclude=()):
+    """
+    Pick a backend and reserve a request slot on it.
+
+    With an image hash the cache-affine backend is preferred as long as its
+    load is within AFFINITY_SLACK of the least loaded backend.
+    """
+    with state_lock:
+        candidates = [b for b in backends if b.healthy and b not in exclude]
+        if not candidates:
+            return None
+
+        least_loaded = min(candidates, key=lambda b: b.in_flight)
+        chosen = least_loaded
+        if image_hash is not None:
+            preferred = ring.lookup(image_hash, lambda b: b in candidates)
+            if preferred.in_flight <= least_loaded.in_flight + AFFINITY_SLACK:
+                chosen = preferred
+
+        chosen.in_flight += 1
+        return chosen
+
+def release_backend(backend):
+    """Release a request slot reserved by choose_backend."""
+    with state_lock:
+        backend.in_flight -= 1
+        backend.served += 1
+
+def image_hash_from_request():
+    """Hash the uploaded image the same way the ml-model cache does."""
+    if 'file' in request.files:
+        file = request.files['file']
+        img_data = file.read()
+        file.seek(0)
+    elif 'image' in request.form:
+        try:
+            img_data = base64.b64decode(request.form['image'])
+        except ValueError:
+            return None
+    else:
+        return None
+    return hashlib.sha256(img_data).hexdigest()
+
+def forward_headers():
+    """Request headers to pass on to a backend."""
+    return {key: value for key, value in request.headers.items()
+            if key.lower() not in HOP_HEADERS and key.lower() != 'host'}
+
+def response_headers(response):
+    """Backend response headers to pass back to the client."""
+    # The router adds its own CORS headers, duplicates make browsers reject them
+    return [(key, value) for key, value in response.headers.items()
+            if key.lower() not in HOP_HEADERS
+            and key.lower() not in ROUTER_HEADERS
+            and not key.lower().startswith('access-control-')]
+
+def timeout_response(backend):
+    """Error response when a backend is too slow to answer."""
+    return jsonify({
+        "status": "error",
+        "message": f"ml-model instance {backend.url} timed out"
+    }), 504
+
+def bad_gateway_response(backend, error):
+    """Error response when a backend request fails after connecting."""
+    return jsonify({
+        "status": "error",
+        "message": f"ml-model instance {backend.url} failed: {str(error)}"
+    }), 502
+
+def no_backend_response():
+    """Error response when no backend can take the request."""
+    return jsonify({
+        "status": "error",
+        "message": "No healthy ml-model instance available"
+    }), 503
+
+@app.route('/health', methods=['GET'])
+def health_check():
+    """Health check endpoint, ok while at least one backend is healthy."""
+    with state_lock:
+        status = [backend.to_dict() for backend in backends]
+    healthy = sum(1 for backend in status if backend["healthy"])
+
+    if not healthy:
+        return jsonify({"status": "error", "message": "No healthy ml-model instance", "backends": status}), 503
+
+    return jsonify({
+        "status": "ok",
+        "message": f"{healthy} of {len(status)} ml-model instances healthy",
+        "backends": status
+    }), 200
+
+@app.route('/predict', methods=['POST'])
+def predict():
+    """Forward a prediction to the cache-affine or least loaded backend."""
+    # Cache the body so it can be both parsed for hashing and forwarded
+    body = request.get_data(cache=True)
+    image_hash = image_hash_from_request()
+
+    # A backend that cannot be reached is retried once on another one. A slow
+    # backend is not: it is still healthy and the inference would run twice
+    tried = []
+    for _ in range(2):
+        backend = choose_backend(image_hash, exclude=tried)
+        if backend is None:
+            break
+        tried.append(backend)
+
+        try:
+            response = requests.post(
+                f"{backend.url}/predict",
+                params=request.args,
+                data=body,
+                headers=forward_headers(),
+                timeout=REQUEST_TIMEOUT
+            )
+        except requests.ConnectionError as e:
+            mark_unhealthy(backend, str(e))
+            continue
+        except requests.Timeout:
+            return timeout_response(backend)
+        except requests.RequestException as e:
+            return bad_gateway_response(backend, e)
+        finally:
+            release_backend(backend)
+
+        headers = response_headers(response)
+        headers.append(('X-Backend', backend.url))
+        return Response(response.content, status=response.status_code, headers=headers)
+
+    return no_backend_response()
+
+@app.route('/predict/video', methods=['POST'])
+def predict_video():
+    """Stream a video analysis through the least loaded backend."""
+    backend = choose_backend()
+    if backend is None:
+        return no_backend_response()
+
+    try:
+        response = requests.post(
+            f"{backend.url}/predict/video",
+            params=request.args,
+            data=request.stream,
+            headers=forward_headers(),
+            stream=True,
+            timeout=REQUEST_TIMEOUT
+        )
+    except requests.ConnectionError as e:
+        release_backend(backend)
+        mark_unhealthy(backend, str(e))
+        return no_backend_response()
+    except requests.Timeout:
+        release_backend(backend)
+        return timeout_response(backend)
+    except requests.RequestException as e:
+        release_backend(backend)
+        return bad_gateway_response(backend, e)
+
+    def generate():
+        try:
+            for chunk in response.iter_content(chunk_size=None):
+                yield chunk
+        finally:
+            response.close()
+            release_backend(backend)
+
+    headers = response_headers(response)
+    headers.append(('X-Backend', backend.url))
+    return Response(generate(), status=response.status_code, headers=headers)
+
+def start_health_checks():
+    """Run the first health check synchronously, then keep checking in the background."""
+    for backend in backends:
+        check_backend(backend)
+    threading.Thread(target=health_loop, daemon=True).start()
+
+if __name__ == '__main__':
+    if not backends:
+        raise SystemExit("Set ML_BACKENDS to a comma-separated list of ml-model URLs")
+
+    start_health_checks()
+
+    # Run the router
+    port = int(os.environ.get("ROUTER_PORT", 5001))
+    app.run(host='0.0.0.0', port=port, threaded=True)
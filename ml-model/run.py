@@ -1,31 +1,60 @@
 """
 Script to start the Flask API
+
+The script owns the listening socket and hands it to a Flask worker process.
+Workers are recycled after WORKER_MAX_REQUESTS requests or once their memory
+passes WORKER_MAX_RSS_MB: a replacement is started and warmed up first, then
+the old worker finishes its in-flight requests and exits.
 """
 import os
+import select
+import socket
 import subprocess
 import sys
 import time
 import atexit
 import signal
+import threading
+
+import memguard
 
 # Get the current directory
 current_dir = os.path.dirname(os.path.abspath(__file__))
 
-# Flask process reference
+# Seconds to wait for a new worker to load the model
+START_TIMEOUT = float(os.environ.get("WORKER_START_TIMEOUT", 180))
+# Seconds a retiring worker gets to drain before it is killed
+DRAIN_TIMEOUT = float(os.environ.get("WORKER_DRAIN_TIMEOUT", 60)) + 10
+# Seconds to wait before retrying a failed recycle
+RECYCLE_RETRY_DELAY = 30
+
+# Flask process references
 flask_process = None
+flask_started_at = 0
+starting_process = None  # replacement still loading the model
+retiring_processes = {}  # process -> time it was asked to stop
+recycle_requested = False
 
 def cleanup():
-    """Clean up function to terminate the Flask process on exit"""
-    global flask_process
-    if flask_process:
-        print("Terminating Flask process...")
+    """Clean up function to terminate the Flask processes on exit"""
+    global flask_process, starting_process
+    processes = list(retiring_processes)
+    for process in (flask_process, starting_process):
+        if process:
+            processes.append(process)
+    flask_process = None
+    starting_process = None
+    retiring_processes.clear()
+
+    for process in processes:
+        print(f"Terminating Flask process {process.pid}...")
         try:
             # Try to terminate gracefully first
-            flask_process.terminate()
-            flask_process.wait(timeout=5)
+            process.terminate()
+            process.wait(timeout=5)
         except:
             # If it doesn't work, force kill
-            flask_process.kill()
+            process.kill()
 
 def signal_handler(sig, frame):
     """Handle Ctrl+C and other signals"""
@@ -33,73 +62,165 @@ def signal_handler(sig, frame):
     cleanup()
     sys.exit(0)
 
+def recycle_handler(sig, frame):
+    """Handle a worker asking to be replaced"""
+    global recycle_requested
+    recycle_requested = True
+
+def create_socket(port):
+    """Create the listening socket shared by all workers"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("0.0.0.0", int(port)))
+    sock.listen(128)
+    return sock
+
+def pipe_output(process):
+    """Print a worker's stdout/stderr in real-time"""
+    for line in process.stdout:
+        print(line.rstrip())
+
+def start_worker(sock, port):
+    """Start a Flask worker and wait until it is ready to take requests"""
+    global starting_process
+    ready_read, ready_write = os.pipe()
+
+    # Set environment variables for the subprocess
+    env = os.environ.copy()
+    env["PORT"] = str(port)
+    env["WORKER_FD"] = str(sock.fileno())
+    env["WORKER_READY_FD"] = str(ready_write)
+    env["WORKER_SUPERVISOR_PID"] = str(os.getpid())
+
+    # Launch Flask app
+    process = subprocess.Popen(
+        [sys.executable, "app.py"],
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        pass_fds=(sock.fileno(), ready_write)
+    )
+    # Registered before waiting so cleanup() also stops a worker still loading
+    starting_process = process
+    os.close(ready_write)
+    threading.Thread(target=pipe_output, args=(process,), daemon=True).start()
+
+    # The worker writes to the pipe once the model is loaded; EOF without
+    # data means it exited first
+    try:
+        readable, _, _ = select.select([ready_read], [], [], START_TIMEOUT)
+        ready = bool(readable) and os.read(ready_read, 1) == b"1"
+    finally:
+        os.close(ready_read)
+        starting_process = None
+
+    if not ready:
+        print(f"Flask worker {process.pid} failed to start")
+        if process.poll() is None:
+            process.kill()
+        return None
+
+    print(f"Flask worker {process.pid} is ready")
+    rss = memguard.read_rss(process.pid)
+    if memguard.MAX_RSS_MB and rss is not None and rss > memguard.MAX_RSS_MB * 1024 * 1024:
+        print(f"WARNING: Flask worker {process.pid} starts at {rss / 1024 / 1024:.0f} MB, above "
+              f"WORKER_MAX_RSS_MB={memguard.MAX_RSS_MB:.0f}. Recycling cannot bring it "
+              f"under the limit, raise WORKER_MAX_RSS_MB.")
+    return process
+
+def retire_worker(process):
+    """Ask a worker to finish its in-flight requests and exit"""
+    process.send_signal(signal.SIGTERM)
+    retiring_processes[process] = time.time()
+
+def reap_retiring_workers():
+    """Forget workers that have exited and kill those that take too long"""
+    for process, stopped_at in list(retiring_processes.items()):
+        if process.poll() is not None:
+            print(f"Flask worker {process.pid} exited after draining")
+            del retiring_processes[process]
+        elif time.time() - stopped_at > DRAIN_TIMEOUT:
+            print(f"Flask worker {process.pid} did not drain in time, killing it")
+            process.kill()
+
+def worker_over_memory_limit(process):
+    """Check the worker's resident memory against WORKER_MAX_RSS_MB"""
+    if not memguard.MAX_RSS_MB or process.poll() is not None:
+        return False
+    rss = memguard.read_rss(process.pid)
+    return rss is not None and rss > memguard.MAX_RSS_MB * 1024 * 1024
+
 def run_flask_app():
     """Run the Flask application on the specified port"""
-    global flask_process
-    
+    global flask_process, flask_started_at, recycle_requested
+
     # Register cleanup handlers
     atexit.register(cleanup)
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
-    
+    signal.signal(signal.SIGUSR1, recycle_handler)
+
     # Get port from environment variable or use default
     port = os.environ.get("FLASK_PORT", "5001")
-    
+
     try:
         # Change to the directory where app.py is located
         os.chdir(current_dir)
-        
+
         # Start the Flask app as a subprocess
         print(f"Starting Flask API on port {port}...")
-        
-        # Set environment variables for the subprocess
-        env = os.environ.copy()
-        env["PORT"] = port
-        
-        # Launch Flask app
-        flask_process = subprocess.Popen(
-            [sys.executable, "app.py"],
-            env=env,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True
-        )
-        
-        # Give Flask time to start up
-        time.sleep(2)
-        
+        sock = create_socket(port)
+        flask_process = start_worker(sock, port)
+        flask_started_at = time.time()
+
         # Check if Flask started successfully
-        if flask_process.poll() is not None:
-            # Process exited already, get any error output
-            output, _ = flask_process.communicate()
-            print(f"Flask failed to start: {output}")
+        if flask_process is None:
             return False
-        
+
         print(f"Flask API is running on http://localhost:{port}/")
-        
-        # Monitor Flask's stdout/stderr in real-time
+
+        # Supervise the worker, replacing it when it dies or needs recycling
+        next_recycle_attempt = 0
         while True:
-            output = flask_process.stdout.readline()
-            if output:
-                print(output.strip())
-            
-            # Check if process is still running
+            reap_retiring_workers()
+
             if flask_process.poll() is not None:
-                # Process exited
-                remaining_output, _ = flask_process.communicate()
-                if remaining_output:
-                    print(remaining_output.strip())
-                print("Flask process terminated.")
-                break
-            
+                print(f"Flask worker {flask_process.pid} terminated unexpectedly, restarting...")
+                recycle_requested = False
+                flask_process = start_worker(sock, port)
+                flask_started_at = time.time()
+                if flask_process is None:
+                    print("Flask process terminated.")
+                    break
+                continue
+
+            # A fresh worker is never recycled for RSS, so a limit below the
+            # size of a loaded model cannot keep two workers alive in a loop
+            uptime = time.time() - flask_started_at
+            if uptime >= memguard.MIN_UPTIME and worker_over_memory_limit(flask_process):
+                recycle_requested = True
+
+            if recycle_requested and time.time() >= next_recycle_attempt:
+                # Warm up the replacement before retiring the old worker
+                print(f"Recycling Flask worker {flask_process.pid}...")
+                replacement = start_worker(sock, port)
+                if replacement is None:
+                    next_recycle_attempt = time.time() + RECYCLE_RETRY_DELAY
+                else:
+                    retire_worker(flask_process)
+                    flask_process = replacement
+                    flask_started_at = time.time()
+                    recycle_requested = False
+
             # Small sleep to prevent high CPU usage
-            time.sleep(0.1)
-            
+            time.sleep(1)
+
         return True
-        
+
     except Exception as e:
         print(f"Error starting Flask: {str(e)}")
         return False
 
 if __name__ == "__main__":
-    run_flask_app()
\ No newline at end of file
+    run_flask_app()
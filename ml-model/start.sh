@@ -3,6 +3,21 @@
 # Set the Flask port (use 5001 as default)
 export FLASK_PORT=5001
 
+# Recycle the worker after N requests or once it uses too much memory
+# (0 disables a limit)
+# export WORKER_MAX_REQUESTS=1000
+# export WORKER_MAX_RSS_MB=1500
+# Seconds a worker must run before its RSS can trigger a recycle
+# export WORKER_MIN_UPTIME=300
+# Record top allocation sites for /admin/memory (stack frames per allocation)
+# export WORKER_TRACEMALLOC=5
+# Token for /admin/memory and the X-Profile header, admin features are off without it
+# export ADMIN_TOKEN=change-me
+# Profile one in every N /predict requests into PROFILE_DIR, keeping the newest files
+# export PROFILE_SAMPLE_RATE=1000
+# export PROFILE_DIR=profiles
+# export PROFILE_MAX_FILES=100
+
 # Activate Python environment if needed
 # source /path/to/venv/bin/activate
 
@@ -0,0 +1,121 @@
+"""
+Tests for the request counting and recycle triggers in memguard.py
+"""
+import os
+import time
+import signal
+import threading
+from unittest import mock
+
+import pytest
+
+import memguard
+
+@pytest.fixture(autouse=True)
+def fresh_worker(monkeypatch):
+    """Reset the worker state and limits before each test."""
+    monkeypatch.setattr(memguard, "requests_served", 0)
+    monkeypatch.setattr(memguard, "in_flight", 0)
+    monkeypatch.setattr(memguard, "recycle_reason", None)
+    monkeypatch.setattr(memguard, "started_at", time.time())
+    monkeypatch.setattr(memguard, "MAX_REQUESTS", 0)
+    monkeypatch.setattr(memguard, "MAX_RSS_MB", 0)
+    monkeypatch.setattr(memguard, "MIN_UPTIME", 300)
+    monkeypatch.delenv("WORKER_SUPERVISOR_PID", raising=False)
+
+def serve_requests(count):
+    for _ in range(count):
+        memguard.request_started()
+        memguard.request_finished()
+
+def test_recycle_after_max_requests(monkeypatch):
+    monkeypatch.setattr(memguard, "MAX_REQUESTS", 3)
+
+    serve_requests(2)
+    assert memguard.recycle_reason is None
+
+    serve_requests(1)
+    assert memguard.recycle_reason == "served 3 requests"
+    assert memguard.requests_served == 3
+    assert memguard.in_flight == 0
+
+def test_rss_recycle_waits_for_min_uptime(monkeypatch):
+    monkeypatch.setattr(memguard, "MAX_RSS_MB", 100)
+    monkeypatch.setattr(memguard, "read_rss", lambda pid="self": 200 * 1024 * 1024)
+
+    # A fresh worker above the limit is not recycled
+    serve_requests(1)
+    assert memguard.recycle_reason is None
+
+    monkeypatch.setattr(memguard, "started_at", time.time() - 301)
+    serve_requests(1)
+    assert memguard.recycle_reason.startswith("RSS 200 MB")
+
+def test_rss_under_limit_is_not_recycled(monkeypatch):
+    monkeypatch.setattr(memguard, "MAX_RSS_MB", 100)
+    monkeypatch.setattr(memguard, "MIN_UPTIME", 0)
+    monkeypatch.setattr(memguard, "read_rss", lambda pid="self": 50 * 1024 * 1024)
+
+    serve_requests(5)
+    assert memguard.recycle_reason is None
+
+def test_supervisor_is_signalled_once(monkeypatch):
+    monkeypatch.setattr(memguard, "MAX_REQUESTS", 1)
+    monkeypatch.setenv("WORKER_SUPERVISOR_PID", str(os.getppid()))
+
+    with mock.patch.object(memguard.os, "kill") as kill:
+        serve_requests(3)
+
+    kill.assert_called_once_with(os.getppid(), signal.SIGUSR1)
+
+def test_adopted_worker_does_not_signal_new_parent(monkeypatch):
+    monkeypatch.setattr(memguard, "MAX_REQUESTS", 1)
+    monkeypatch.setenv("WORKER_SUPERVISOR_PID", str(os.getppid() + 1))
+
+    with mock.patch.object(memguard.os, "kill") as kill:
+        serve_requests(1)
+
+    kill.assert_not_called()
+
+def test_signal_errors_do_not_escape(monkeypatch):
+    monkeypatch.setattr(memguard, "MAX_REQUESTS", 1)
+    monkeypatch.setenv("WORKER_SUPERVISOR_PID", str(os.getppid()))
+
+    with mock.patch.object(memguard.os, "kill", side_effect=ProcessLookupError()):
+        serve_requests(1)
+
+    assert memguard.recycle_reason is not None
+
+def test_wait_for_idle_waits_for_in_flight_request():
+    memguard.request_started()
+    finisher = threading.Timer(0.2, memguard.request_finished)
+    finisher.start()
+
+    started = time.monotonic()
+    assert memguard.wait_for_idle(5)
+    assert time.monotonic() - started >= 0.15
+    finisher.join()
+
+def test_wait_for_idle_times_out():
+    memguard.request_started()
+    assert not memguard.wait_for_idle(0.1)
+    memguard.request_finished()
+
+def test_middleware_counts_until_response_is_closed():
+    def wsgi_app(environ, start_response):
+        start_response('200 OK', [])
+        return [b"body"]
+
+    tracked = memguard.TrackRequests(wsgi_app, untracked_paths={'/health'})
+    response = tracked({'PATH_INFO': '/predict'}, lambda status, headers: None)
+    assert memguard.in_flight == 1
+
+    assert list(response) == [b"body"]
+    assert memguard.in_flight == 1
+
+    response.close()
+    assert memguard.in_flight == 0
+    assert memguard.requests_served == 1
+
+    tracked({'PATH_INFO': '/health'}, lambda status, headers: None)
+    assert memguard.requests_served == 1
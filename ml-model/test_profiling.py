@@ -0,0 +1,75 @@
+"""
+Tests for the request profiling hook in profiling.py
+"""
+import os
+import itertools
+
+import pytest
+from flask import Flask, jsonify, request
+
+import profiling
+
+PROFILE_HEADERS = ('X-Profile', 'X-Profile-File', 'X-Profile-Time', 'X-Profile-TF-Dir')
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    """App with one profiled view, admins send X-Admin-Token: secret."""
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path))
+    monkeypatch.setattr(profiling, "SAMPLE_RATE", 0)
+    monkeypatch.setattr(profiling, "request_counter", itertools.count(1))
+
+    app = Flask(__name__)
+
+    @app.route('/predict', methods=['POST'])
+    @profiling.profiled(lambda: request.headers.get('X-Admin-Token') == 'secret')
+    def predict():
+        return jsonify({"status": "success"}), 200
+
+    return app.test_client()
+
+def saved_profiles(tmp_path):
+    return [name for name in os.listdir(tmp_path) if name.endswith('.prof')]
+
+def test_unprofiled_request(client, tmp_path):
+    response = client.post('/predict')
+
+    assert response.get_json() == {"status": "success"}
+    assert not any(header in response.headers for header in PROFILE_HEADERS)
+    assert saved_profiles(tmp_path) == []
+
+def test_profile_header_needs_admin(client, tmp_path):
+    response = client.post('/predict', headers={'X-Profile': 'inline'})
+
+    assert "profile" not in response.get_json()
+    assert not any(header in response.headers for header in PROFILE_HEADERS)
+
+def test_admin_inline_profile(client):
+    response = client.post('/predict', headers={'X-Profile': 'inline', 'X-Admin-Token': 'secret'})
+
+    profile = response.get_json()["profile"]
+    assert "predict" in profile["stats"]
+    assert "X-Profile-Time" in response.headers
+
+def test_admin_saved_profile(client, tmp_path):
+    response = client.post('/predict', headers={'X-Profile': 'save', 'X-Admin-Token': 'secret'})
+
+    assert os.path.exists(response.headers['X-Profile-File'])
+
+def test_sampled_request_is_saved_without_headers(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "SAMPLE_RATE", 2)
+
+    responses = [client.post('/predict') for _ in range(4)]
+
+    assert len(saved_profiles(tmp_path)) == 2
+    for response in responses:
+        assert response.get_json() == {"status": "success"}
+        assert not any(header in response.headers for header in PROFILE_HEADERS)
+
+def test_saved_profiles_are_capped(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "SAMPLE_RATE", 1)
+    monkeypatch.setattr(profiling, "MAX_FILES", 3)
+
+    for _ in range(6):
+        client.post('/predict')
+
+    assert len(saved_profiles(tmp_path)) == 3
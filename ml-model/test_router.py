@@ -0,0 +1,123 @@
+"""
+Tests for the hash ring, backend selection and forwarding in router.py
+"""
+import hashlib
+from unittest import mock
+
+import pytest
+import requests
+
+import router
+
+KEYS = [hashlib.sha256(str(i).encode()).hexdigest() for i in range(2000)]
+
+@pytest.fixture
+def backends(monkeypatch):
+    """Three healthy backends installed as the router's backends and ring."""
+    nodes = [router.Backend(f"http://localhost:{port}") for port in (5002, 5003, 5004)]
+    for node in nodes:
+        node.healthy = True
+    monkeypatch.setattr(router, "backends", nodes)
+    monkeypatch.setattr(router, "ring", router.HashRing(nodes))
+    return nodes
+
+def owners(ring, accept=lambda backend: True):
+    return {key: ring.lookup(key, accept) for key in KEYS}
+
+def test_ring_spreads_keys_over_all_backends(backends):
+    counts = {}
+    for backend in owners(router.ring).values():
+        counts[backend.url] = counts.get(backend.url, 0) + 1
+
+    assert len(counts) == 3
+    assert min(counts.values()) > len(KEYS) / 10
+
+def test_ring_is_deterministic(backends):
+    other = router.HashRing(list(reversed(backends)))
+    for key in KEYS[:100]:
+        assert router.ring.lookup(key, lambda b: True).url == other.lookup(key, lambda b: True).url
+
+def test_leaving_backend_only_moves_its_own_keys(backends):
+    leaving = backends[1]
+    before = owners(router.ring)
+    after = owners(router.ring, lambda backend: backend is not leaving)
+
+    for key in KEYS:
+        if before[key] is leaving:
+            assert after[key] is not leaving
+        else:
+            assert after[key] is before[key]
+
+def test_keys_return_to_backend_on_rejoin(backends, monkeypatch):
+    # Ignore load so every pick follows the ring
+    monkeypatch.setattr(router, "AFFINITY_SLACK", len(KEYS))
+    before = {key: router.choose_backend(key) for key in KEYS}
+
+    backends[1].healthy = False
+    during = {key: router.choose_backend(key) for key in KEYS}
+    assert backends[1] not in during.values()
+
+    backends[1].healthy = True
+    after = {key: router.choose_backend(key) for key in KEYS}
+    assert after == before
+    assert backends[1] in after.values()
+
+def test_affine_backend_is_used_within_slack(backends, monkeypatch):
+    monkeypatch.setattr(router, "AFFINITY_SLACK", 2)
+    key = KEYS[0]
+    preferred = router.ring.lookup(key, lambda b: True)
+    preferred.in_flight = 2
+
+    assert router.choose_backend(key) is preferred
+    assert preferred.in_flight == 3
+
+def test_busy_affine_backend_falls_back_to_least_loaded(backends, monkeypatch):
+    monkeypatch.setattr(router, "AFFINITY_SLACK", 2)
+    key = KEYS[0]
+    preferred = router.ring.lookup(key, lambda b: True)
+    preferred.in_flight = 3
+    others = [b for b in backends if b is not preferred]
+    others[0].in_flight = 1
+
+    assert router.choose_backend(key) is others[1]
+
+def test_no_healthy_backend(backends):
+    for backend in backends:
+        backend.healthy = False
+    assert router.choose_backend(KEYS[0]) is None
+
+def test_release_backend_frees_slot(backends):
+    backend = router.choose_backend()
+    router.release_backend(backend)
+    assert backend.in_flight == 0
+    assert backend.served == 1
+
+def predict(client):
+    return client.post('/predict', data={'image': 'aGVsbG8='})
+
+def test_read_timeout_returns_504_and_keeps_backend_healthy(backends):
+    client = router.app.test_client()
+    with mock.patch.object(router.requests, "post", side_effect=requests.ReadTimeout()) as post:
+        response = predict(client)
+
+    assert response.status_code == 504
+    assert post.call_count == 1
+    assert all(backend.healthy for backend in backends)
+    assert all(backend.in_flight == 0 for backend in backends)
+
+def test_connection_error_retries_on_another_backend(backends):
+    client = router.app.test_client()
+    ok = mock.Mock(status_code=200, content=b'{"status": "success"}',
+                   headers={'Content-Type': 'application/json', 'Server': 'Werkzeug',
+                            'Access-Control-Allow-Origin': '*'})
+    with mock.patch.object(router.requests, "post",
+                           side_effect=[requests.ConnectionError("refused"), ok]) as post:
+        response = predict(client)
+
+    assert response.status_code == 200
+    assert post.call_count == 2
+    assert sum(not backend.healthy for backend in backends) == 1
+
+    # Headers the router sets itself are not copied from the backend
+    assert response.headers.getlist('Access-Control-Allow-Origin') == ['*']
+    assert 'Server' not in response.headers
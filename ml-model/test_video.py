@@ -0,0 +1,111 @@
+"""
+Tests for the frame sampling, dedup and segment logic in video.py
+"""
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+import video
+
+# Two frames with opposite horizontal gradients, so their hashes differ fully
+FRAME_A = Image.linear_gradient('L').rotate(90).convert('RGB')
+FRAME_B = Image.linear_gradient('L').rotate(-90).convert('RGB')
+
+def fake_predict_batch(images):
+    """Label frame A as diseased and frame B as healthy."""
+    predictions = []
+    for img in images:
+        diseased = img is FRAME_A
+        predictions.append({
+            "class_en": "Leaf Blight" if diseased else "Healthy",
+            "class_ar": "",
+            "confidence": 0.9 if diseased else 0.6,
+            "severity": "high" if diseased else "medium"
+        })
+    return predictions
+
+def run(frames, **kwargs):
+    events = list(video.analyze_frames(iter(frames), fake_predict_batch, **kwargs))
+    return ([e for e in events if e["type"] == "frame"],
+            [e for e in events if e["type"] == "segment"],
+            events[-1])
+
+def test_duplicate_frames_are_skipped_within_a_segment():
+    frames, segments, summary = run([(0, FRAME_A), (1, FRAME_A), (2, FRAME_B), (3, FRAME_B)])
+
+    assert [f["timestamp"] for f in frames] == [0, 2]
+    assert len(segments) == 1
+    assert segments[0]["frames_analyzed"] == 2
+    assert segments[0]["frames_skipped"] == 2
+    assert summary["frames_skipped"] == 2
+
+def test_unchanged_view_still_reports_every_segment():
+    timestamps = [0, 1, 2, 11, 12, 25, 31]
+    frames, segments, summary = run([(t, FRAME_A) for t in timestamps], batch_size=2)
+
+    assert [s["segment"] for s in segments] == [0, 1, 2, 3]
+    assert all(s["dominant"] == "Leaf Blight" for s in segments)
+    assert sum(s["frames_skipped"] for s in segments) == summary["frames_skipped"]
+    assert sum(s["frames_analyzed"] for s in segments) == summary["frames_analyzed"]
+    assert summary["frames_sampled"] == len(timestamps)
+    assert summary["segments"] == 4
+
+def test_segment_summary_orders_diseases_by_frames():
+    _, segments, _ = run([(0, FRAME_A), (1, FRAME_B), (2, FRAME_A)], dedup_threshold=-1)
+
+    diseases = segments[0]["diseases"]
+    assert [d["class_en"] for d in diseases] == ["Leaf Blight", "Healthy"]
+    assert diseases[0]["frames"] == 2
+    assert diseases[0]["mean_confidence"] == 0.9
+    assert segments[0]["frames_skipped"] == 0
+
+def multipart_body(boundary, parts):
+    """Encode (name, filename, payload) parts as a multipart/form-data body."""
+    body = b""
+    for name, filename, payload in parts:
+        disposition = f'form-data; name="{name}"'
+        if filename:
+            disposition += f'; filename="{filename}"'
+        body += f"--{boundary}\r\nContent-Disposition: {disposition}\r\n\r\n".encode() + payload + b"\r\n"
+    return body + f"--{boundary}--\r\n".encode()
+
+def png_bytes(img):
+    buffer = BytesIO()
+    img.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+class ChunkedStream(BytesIO):
+    """Stream that records how many bytes have been read."""
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.consumed = self.tell()
+        return data
+
+def test_multipart_frames_are_decoded_as_they_arrive():
+    parts = [("note", None, b"walk-through")]
+    parts += [("frames", f"{i}.png", png_bytes(FRAME_A if i % 2 else FRAME_B)) for i in range(6)]
+    body = multipart_body("xyz", parts)
+    stream = ChunkedStream(body)
+
+    frames = video.iter_multipart_frames(stream, b"xyz", sample_fps=1, source_fps=2, chunk_size=1024)
+    timestamp, img = next(frames)
+
+    # The first frame is available before the whole body has been read
+    assert timestamp == 0
+    assert img.size == FRAME_B.size
+    assert stream.consumed < len(body)
+
+    # Every second frame is sampled at 1 fps from a 2 fps sequence
+    assert [t for t, _ in frames] == [1, 2]
+
+def test_multipart_without_frames_is_rejected():
+    body = multipart_body("xyz", [("note", None, b"nothing here")])
+    with pytest.raises(ValueError):
+        list(video.iter_multipart_frames(BytesIO(body), b"xyz"))
+
+def test_truncated_multipart_is_rejected():
+    body = multipart_body("xyz", [("frames", "0.png", png_bytes(FRAME_A))])
+    with pytest.raises(ValueError):
+        list(video.iter_multipart_frames(BytesIO(body[:-40]), b"xyz"))
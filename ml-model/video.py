@@ -0,0 +1,315 @@
+"""
+Video and frame-sequence ingestion for the plant disease model.
+
+Frames are sampled at a fixed rate, near-identical frames are dropped using a
+difference hash, and the remaining frames are predicted in batches. Results
+are produced as a stream of events so a whole video never has to be held in
+memory.
+"""
+import os
+import sys
+import json
+import logging
+import argparse
+import tempfile
+from io import BytesIO
+from PIL import Image
+from werkzeug.sansio.multipart import MultipartDecoder, NeedData, File, Field, Data, Epilogue
+
+try:
+    import cv2
+except ImportError:  # Only needed for video files, not frame sequences
+    cv2 = None
+
+logger = logging.getLogger(__name__)
+
+# Default ingestion settings
+DEFAULT_SAMPLE_FPS = 1.0
+DEFAULT_BATCH_SIZE = 16
+DEFAULT_SEGMENT_SECONDS = 10.0
+DEFAULT_DEDUP_THRESHOLD = 5  # Max differing bits (out of 64) for a duplicate
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+def iter_video_frames(path, sample_fps=DEFAULT_SAMPLE_FPS):
+    """Yield (timestamp, PIL image) pairs sampled from a video file."""
+    if cv2 is None:
+        raise RuntimeError("Video decoding requires opencv-python-headless")
+
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise ValueError("Could not open video stream")
+
+    try:
+        source_fps = capture.get(cv2.CAP_PROP_FPS) or 0
+        if source_fps <= 0:
+            # Unknown frame rate, assume every frame is one sample
+            source_fps = sample_fps
+        step = max(1, int(round(source_fps / sample_fps)))
+
+        index = 0
+        while True:
+            # grab() skips decoding, only retrieve() the frames we keep
+            if not capture.grab():
+                break
+            if index % step == 0:
+                ok, frame = capture.retrieve()
+                if not ok:
+                    break
+                rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                yield index / source_fps, Image.fromarray(rgb)
+            index += 1
+    finally:
+        capture.release()
+
+def iter_image_frames(files, sample_fps=DEFAULT_SAMPLE_FPS, source_fps=None):
+    """Yield (timestamp, PIL image) pairs sampled from an ordered frame sequence."""
+    source_fps = source_fps or sample_fps
+    step = max(1, int(round(source_fps / sample_fps)))
+
+    for index, file in enumerate(files):
+        if index % step != 0:
+            continue
+        img = Image.open(file).convert('RGB')
+        yield index / source_fps, img
+
+def iter_multipart_frames(stream, boundary, sample_fps=DEFAULT_SAMPLE_FPS,
+                          source_fps=None, chunk_size=UPLOAD_CHUNK_SIZE):
+    """
+    Yield (timestamp, PIL image) pairs from a multipart upload as it arrives.
+
+    Each 'frames' part is decoded once it has been received, and only if it is
+    sampled, so at most one frame is buffered. A 'video' part is written
+    straight to a temporary file and decoded when its upload is complete.
+    """
+    source_fps = source_fps or sample_fps
+    step = max(1, int(round(source_fps / sample_fps)))
+
+    decoder = MultipartDecoder(boundary)
+    frame_index = 0
+    found = False
+    ended = False
+    part = None
+    buffer = None
+    video_file = None
+
+    try:
+        while True:
+            event = decoder.next_event()
+
+            if isinstance(event, NeedData):
+                if ended:
+                    raise ValueError("Incomplete multipart upload")
+                chunk = stream.read(chunk_size)
+                ended = not chunk
+                decoder.receive_data(chunk or None)
+
+            elif isinstance(event, File) and event.name == 'frames':
+                part = 'frames'
+                found = True
+                buffer = BytesIO() if frame_index % step == 0 else None
+
+            elif isinstance(event, File) and event.name == 'video':
+                part = 'video'
+                found = True
+                suffix = os.path.splitext(event.filename or '')[1] or '.mp4'
+                video_file = tempfile.NamedTemporaryFile(suffix=suffix, delete=False)
+
+            elif isinstance(event, (File, Field)):
+                part = None
+
+            elif isinstance(event, Data) and part == 'frames':
+                if buffer is not None:
+                    buffer.write(event.data)
+                if not event.more_data:
+                    if buffer is not None:
+                        buffer.seek(0)
+                        yield frame_index / source_fps, Image.open(buffer).convert('RGB')
+                        buffer = None
+                    frame_index += 1
+
+            elif isinstance(event, Data) and part == 'video':
+                video_file.write(event.data)
+                if not event.more_data:
+                    video_file.close()
+                    yield from iter_video_frames(video_file.name, sample_fps)
+                    os.remove(video_file.name)
+                    video_file = None
+
+            elif isinstance(event, Epilogue):
+                break
+    finally:
+        if video_file is not None:
+            video_file.close()
+            os.remove(video_file.name)
+
+    if not found:
+        raise ValueError("No video file or frames provided")
+
+def frame_signature(img):
+    """Compute a 64-bit difference hash of an image."""
+    small = img.convert('L').resize((9, 8), Image.BILINEAR)
+    pixels = list(small.tobytes())
+
+    signature = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            signature = (signature << 1) | (left > right)
+    return signature
+
+def is_near_duplicate(signature, previous, threshold=DEFAULT_DEDUP_THRESHOLD):
+    """Check whether two frame signatures differ by at most threshold bits."""
+    if previous is None or threshold < 0:
+        return False
+    return bin(signature ^ previous).count('1') <= threshold
+
+def empty_segment(index, segment_seconds):
+    """Create the running summary for one time segment."""
+    return {
+        "segment": index,
+        "start": round(index * segment_seconds, 2),
+        "end": round((index + 1) * segment_seconds, 2),
+        "frames_analyzed": 0,
+        "frames_skipped": 0,
+        "diseases": {}
+    }
+
+def add_to_segment(segment, prediction):
+    """Add one frame prediction to a segment summary."""
+    segment["frames_analyzed"] += 1
+    entry = segment["diseases"].setdefault(prediction["class_en"], {
+        "class_en": prediction["class_en"],
+        "class_ar": prediction["class_ar"],
+        "frames": 0,
+        "max_confidence": 0.0,
+        "total_confidence": 0.0
+    })
+    entry["frames"] += 1
+    entry["total_confidence"] += prediction["confidence"]
+    entry["max_confidence"] = max(entry["max_confidence"], prediction["confidence"])
+
+def finish_segment(segment):
+    """Convert a running segment summary into its final event."""
+    diseases = []
+    for entry in segment["diseases"].values():
+        total = entry.pop("total_confidence")
+        entry["mean_confidence"] = round(total / entry["frames"], 2)
+        diseases.append(entry)
+    diseases.sort(key=lambda entry: (entry["frames"], entry["max_confidence"]), reverse=True)
+
+    segment["diseases"] = diseases
+    segment["dominant"] = diseases[0]["class_en"] if diseases else None
+    segment["type"] = "segment"
+    return segment
+
+def analyze_frames(frames, predict_batch,
+                   batch_size=DEFAULT_BATCH_SIZE,
+                   segment_seconds=DEFAULT_SEGMENT_SECONDS,
+                   dedup_threshold=DEFAULT_DEDUP_THRESHOLD):
+    """
+    Run sampled frames through the model and yield result events.
+
+    Yields a "frame" event per analyzed frame, a "segment" event each time a
+    segment is complete and a final "summary" event.
+    """
+    pending = []
+    skipped = {}
+    current = None
+    segments = 0
+    counts = {"frames_sampled": 0, "frames_skipped": 0, "frames_analyzed": 0}
+    previous_signature = None
+    previous_segment = None
+
+    def process(batch):
+        nonlocal current, segments
+        predictions = predict_batch([img for _, img in batch])
+        for (timestamp, _), prediction in zip(batch, predictions):
+            index = int(timestamp // segment_seconds)
+            if current is not None and index != current["segment"]:
+                segments += 1
+                yield finish_segment(current)
+                current = None
+            if current is None:
+                current = empty_segment(index, segment_seconds)
+                current["frames_skipped"] = skipped.pop(index, 0)
+            add_to_segment(current, prediction)
+            counts["frames_analyzed"] += 1
+            yield {
+                "type": "frame",
+                "timestamp": round(timestamp, 2),
+                "segment": index,
+                "prediction": prediction
+            }
+
+    for timestamp, img in frames:
+        counts["frames_sampled"] += 1
+        index = int(timestamp // segment_seconds)
+        if index != previous_segment:
+            # Only dedup within a segment, so every segment analyzes a frame
+            previous_signature = None
+            previous_segment = index
+
+        signature = frame_signature(img)
+        if is_near_duplicate(signature, previous_signature, dedup_threshold):
+            if current is not None and index == current["segment"]:
+                current["frames_skipped"] += 1
+            else:
+                skipped[index] = skipped.get(index, 0) + 1
+            counts["frames_skipped"] += 1
+            continue
+        previous_signature = signature
+
+        pending.append((timestamp, img))
+        if len(pending) >= batch_size:
+            yield from process(pending)
+            pending = []
+
+    if pending:
+        yield from process(pending)
+    if current is not None:
+        segments += 1
+        yield finish_segment(current)
+
+    counts["segments"] = segments
+    counts["type"] = "summary"
+    yield counts
+
+def main():
+    """Analyze a video file or a directory of frames from the command line."""
+    parser = argparse.ArgumentParser(description="Analyze a field video or frame sequence")
+    parser.add_argument("source", help="Video file or directory of ordered frames")
+    parser.add_argument("--sample-fps", type=float, default=DEFAULT_SAMPLE_FPS)
+    parser.add_argument("--source-fps", type=float, default=None,
+                        help="Frame rate of a frame directory (defaults to --sample-fps)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--segment-seconds", type=float, default=DEFAULT_SEGMENT_SECONDS)
+    parser.add_argument("--dedup-threshold", type=int, default=DEFAULT_DEDUP_THRESHOLD,
+                        help="Max differing hash bits to treat frames as duplicates (-1 disables)")
+    args = parser.parse_args()
+
+    source = os.path.abspath(args.source)
+
+    # The model paths are relative to this directory
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    import app
+    if not app.ensure_model_loaded():
+        print("Failed to load model or class indices", file=sys.stderr)
+        return 1
+
+    if os.path.isdir(source):
+        paths = sorted(os.path.join(source, name) for name in os.listdir(source))
+        frames = iter_image_frames(paths, args.sample_fps, args.source_fps)
+    else:
+        frames = iter_video_frames(source, args.sample_fps)
+
+    events = analyze_frames(frames, app.predict_images,
+                            batch_size=args.batch_size,
+                            segment_seconds=args.segment_seconds,
+                            dedup_threshold=args.dedup_threshold)
+    for event in events:
+        print(json.dumps(event, ensure_ascii=False), flush=True)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())